@@ -1,9 +1,81 @@
-from collections import defaultdict  # Import defaultdict to manage the adjacency list of the constraint graph.
+from collections import defaultdict  # Import defaultdict to group the digit combinations by clue.
+from functools import lru_cache  # Memoizes the per-clue support tables shared by groups with the same clue.
+from itertools import combinations  # Used to enumerate the digit combinations of every clue.
+
+ALL_DIGITS = 0b1111111110  # Domain bitmask containing the digits 1-9 (bit d set for digit d).
+
+
+def domain_values(domain):
+    """
+    Returns the digits contained in a domain bitmask, in increasing order.
+    """
+    values = []
+    while domain:  # Peel off the lowest set bit until the mask is empty.
+        lsb = domain & -domain
+        values.append(lsb.bit_length() - 1)
+        domain ^= lsb
+    return values
+
+
+DOMAIN_VALUES = [domain_values(domain) for domain in range(ALL_DIGITS + 1)]  # Digits of every possible domain, precomputed.
+
+
+def digits_mask(digits):
+    """
+    Returns the bitmask of a collection of digits.
+    """
+    mask = 0
+    for digit in digits:
+        mask |= 1 << digit
+    return mask
+
+
+# Bitmasks of the sets of distinct digits 1-9 adding up to each (sum, length) clue, computed once.
+KAKURO_COMBOS = defaultdict(list)
+for length in range(1, 10):
+    for combo in combinations(range(1, 10), length):
+        KAKURO_COMBOS[(sum(combo), length)].append(digits_mask(combo))
+KAKURO_COMBOS = dict(KAKURO_COMBOS)
+
+
+def build_feasible():
+    """
+    Returns a dictionary mapping (target_sum, remaining_cells, used_mask) to the bitmask of digits that can still be
+    placed in a group of the given clue whose assigned cells use the digits of used_mask, while remaining_cells cells
+    are left. Missing keys mean the partial group cannot be completed.
+    """
+    feasible = defaultdict(int)
+    for (total, length), combo_masks in KAKURO_COMBOS.items():
+        for combo_mask in combo_masks:
+            used = combo_mask
+            while True:  # Enumerate every subset of the combination as a possible set of used digits.
+                feasible[(total, length - used.bit_count(), used)] |= combo_mask ^ used
+                if not used:
+                    break
+                used = (used - 1) & combo_mask
+    return dict(feasible)
+
+
+KAKURO_FEASIBLE = build_feasible()  # Digits that keep each partially filled group completable, computed once.
+
+
+@lru_cache(maxsize=None)
+def clue_supports(target_sum, length):
+    """
+    Returns, for each digit x, the bitmask of digits another cell of a (sum, length) clue may take alongside x
+    (both appear in a valid combination and differ).
+    """
+    supports = [0] * 10
+    for combo_mask in KAKURO_COMBOS.get((target_sum, length), ()):
+        for digit in DOMAIN_VALUES[combo_mask]:
+            supports[digit] |= combo_mask & ~(1 << digit)
+    return tuple(supports)
 
 class CSP:
     """
     The CSP (Constraint Satisfaction Problem) class encapsulates the functionality of a generic CSP solver.
-    - Variables represent the nodes of the graph.
+    - Variables represent the nodes of the graph. Each variable is identified by a contiguous integer id,
+      so that all per-variable and per-constraint state is stored in flat lists indexed by id.
     - Constraints are rules that define valid relationships between variables.
     - The constraint graph represents the connections between variables based on constraints.
     """
@@ -11,50 +83,148 @@ class CSP:
     def __init__(self):
         """
         Initializes the CSP instance with:
-        - variables: Dictionary mapping variables to their domains. Each variable is associated with a list of possible values.
-        - constraints: List of constraints as tuples (variables, constraint function).
+        - variables: List of the variables (e.g., (row, col) for a cell), indexed by variable id.
+        - var_index: Dictionary mapping each variable to its id.
+        - domains: Domain of each variable id, as a bitmask of possible values (bit d set for digit d).
+        - constraints: List of constraints, each given by the list of variable ids it applies to.
         - constraint_graph: Adjacency list representing connections between variables based on constraints.
+        - neighbors_tuple: Frozen copy of each variable id's adjacency set, used for fast iteration during search.
+        - arcs: Every directed arc (Xi, Xj) of the graph, ordered by Xi, used to seed AC-3.
+        - var_to_constraints: Ids of the constraints each variable id belongs to.
+        - pair_constraints: Ids of the constraints shared by each pair of neighboring variable ids.
+        - target, size: Required sum and number of variables of each constraint.
+        - combo_count: Number of digit combinations that satisfy each constraint, used to rank their tightness.
+        - supports: For each constraint and digit x, the bitmask of digits another variable of the constraint may take
+          alongside x (both appear in a valid combination and differ).
+        - assigned_count, used_mask: Running state of each constraint for the current assignment.
+        - allowed_mask: Digits that can still be placed in each constraint, cached from KAKURO_FEASIBLE.
         """
-        self.variables = {}  # Holds variables as keys and their domains as values.
-        self.constraints = []  # Stores constraints as a list of (variables, constraint function) tuples.
-        self.constraint_graph = defaultdict(set)  # Represents the graph where variables are nodes and edges are constraints.
+        self.variables = []  # Holds the variables, indexed by id.
+        self.var_index = {}  # Maps each variable to its id.
+        self.domains = []  # Holds the domain bitmask of each variable id.
+        self.constraints = []  # Stores the variable ids of each constraint, indexed by constraint id.
+        self.constraint_graph = []  # Represents the graph where variables are nodes and edges are constraints.
+        self.neighbors_tuple = []  # Holds the neighbors of each variable id as a sorted tuple.
+        self.arcs = ()  # All directed arcs of the graph.
+        self.var_to_constraints = []  # Holds the ids of the constraints of each variable id.
+        self.pair_constraints = {}  # Maps (var1, var2) to the ids of the constraints involving both.
+        self.target = []  # Required sum of each constraint.
+        self.size = []  # Number of variables in each constraint.
+        self.combo_count = []  # Number of valid digit combinations of each constraint.
+        self.supports = []  # Pairwise support bitmasks of each constraint, indexed by digit.
+        self.assigned_count = []  # Number of variables currently assigned in each constraint.
+        self.used_mask = []  # Bitmask of the digits currently used in each constraint (bit d set for digit d).
+        self.allowed_mask = []  # Bitmask of the digits that keep each constraint completable.
 
     def add_variable(self, var, domain):
         """
-        Adds a variable to the CSP with a specified domain.
+        Adds a variable to the CSP with a specified domain and returns its id.
         - var: The variable to add (e.g., (row, col) for a cell).
-        - domain: The list of possible values for this variable.
+        - domain: The bitmask of possible values for this variable.
         """
-        self.variables[var] = domain  # Add the variable and its domain to the variables dictionary.
+        var_id = len(self.variables)  # Ids are assigned contiguously in insertion order.
+        self.variables.append(var)
+        self.var_index[var] = var_id
+        self.domains.append(domain)
+        self.constraint_graph.append(set())
+        self.neighbors_tuple.append(())
+        self.var_to_constraints.append([])
+        return var_id
 
-    def add_constraint(self, variables, constraint_fn):
+    def add_constraint(self, variables, target_sum):
         """
-        Adds a constraint to the CSP.
-        - variables: List of variables that the constraint applies to.
-        - constraint_fn: A function defining the constraint logic.
+        Adds a sum constraint to the CSP: the values of the variables must be distinct and add up to target_sum.
+        - variables: List of variable ids that the constraint applies to.
+        - target_sum: The required sum of the values.
         """
-        self.constraints.append((variables, constraint_fn))  # Add the constraint to the list.
+        cid = len(self.constraints)  # Id of the new constraint.
+        self.constraints.append(variables)  # Add the constraint to the list.
+        self.target.append(target_sum)
+        self.size.append(len(variables))
+        self.combo_count.append(len(KAKURO_COMBOS.get((target_sum, len(variables)), ())))
+        self.supports.append(clue_supports(target_sum, len(variables)))  # Binary decomposition of the constraint.
+        self.assigned_count.append(0)
+        self.used_mask.append(0)
+        self.allowed_mask.append(KAKURO_FEASIBLE.get((target_sum, len(variables), 0), 0))
         for var1 in variables:  # For each pair of variables in the constraint,
+            self.var_to_constraints[var1].append(cid)  # Index the constraint by its variables.
             for var2 in variables:
                 if var1 != var2:  # If they are distinct,
                     self.constraint_graph[var1].add(var2)  # Create a graph edge.
+                    self.pair_constraints.setdefault((var1, var2), []).append(cid)
+            self.neighbors_tuple[var1] = tuple(sorted(self.constraint_graph[var1]))  # Refresh the frozen neighbors.
+
+    def build_arcs(self):
+        """
+        Precomputes the list of arcs of the constraint graph.
+        Must be called once all constraints have been added.
+        """
+        self.arcs = tuple((var, neighbor) for var, neighbors in enumerate(self.neighbors_tuple)
+                          for neighbor in neighbors)
+
+    def order_constraints_by_tightness(self):
+        """
+        Sorts the constraints of every variable by ascending number of valid digit combinations, so that the
+        tightest constraints are checked first and invalid assignments are rejected as early as possible.
+        """
+        for cids in self.var_to_constraints:
+            cids.sort(key=self.combo_count.__getitem__)
+        for cids in self.pair_constraints.values():
+            cids.sort(key=self.combo_count.__getitem__)
+
+    def is_consistent(self, var, value):
+        """
+        Checks whether assigning value to var keeps the current assignment valid, i.e. every group of var can still
+        be completed with distinct digits adding up to its target. Only the constraints involving var are checked,
+        using their running state.
+        - var: The variable being assigned.
+        - value: The value being assigned.
+        """
+        bit = 1 << value
+        allowed_mask = self.allowed_mask
+        for cid in self.var_to_constraints[var]:  # Only the constraints touching var can be violated.
+            if not allowed_mask[cid] & bit:  # The group could not be completed.
+                return False
+        return True  # All constraints of var are satisfied.
+
+    def assign(self, var, value):
+        """
+        Records the assignment of value to var in the running state of its constraints.
+        """
+        bit = 1 << value
+        target, size, assigned_count, used_mask = self.target, self.size, self.assigned_count, self.used_mask
+        allowed_mask, feasible = self.allowed_mask, KAKURO_FEASIBLE
+        for cid in self.var_to_constraints[var]:
+            assigned_count[cid] += 1
+            used_mask[cid] |= bit
+            allowed_mask[cid] = feasible.get((target[cid], size[cid] - assigned_count[cid], used_mask[cid]), 0)
+
+    def unassign(self, var, value):
+        """
+        Reverts a previous assign(var, value).
+        """
+        clear = ~(1 << value)
+        target, size, assigned_count, used_mask = self.target, self.size, self.assigned_count, self.used_mask
+        allowed_mask, feasible = self.allowed_mask, KAKURO_FEASIBLE
+        for cid in self.var_to_constraints[var]:
+            assigned_count[cid] -= 1
+            used_mask[cid] &= clear
+            allowed_mask[cid] = feasible.get((target[cid], size[cid] - assigned_count[cid], used_mask[cid]), 0)
 
-    def is_valid_assignment(self, assignment):
+    def reset_assignment(self):
         """
-        Checks whether a given assignment satisfies all constraints.
-        - assignment: Dictionary mapping variables to assigned values.
+        Clears the running state of all constraints (no variable assigned).
         """
-        for variables, constraint_fn in self.constraints:  # Iterate over all constraints.
-            values = [assignment.get(var) for var in variables]  # Get the values assigned to these variables.
-            if None not in values and not constraint_fn(*values):  # If all values are assigned but the constraint fails,
-                return False  # Return false for invalid assignment.
-        return True  # All constraints are satisfied.
+        for cid in range(len(self.constraints)):
+            self.assigned_count[cid] = 0
+            self.used_mask[cid] = 0
+            self.allowed_mask[cid] = KAKURO_FEASIBLE.get((self.target[cid], self.size[cid], 0), 0)
 
     def get_neighbors(self, var):
         """
         Retrieves neighbors of a variable from the constraint graph.
         """
-        return self.constraint_graph.get(var, set())  # Return all connected variables.
+        return self.neighbors_tuple[var]  # Return all connected variables.
 
     def display_constraint_graph_size(self):
         """
@@ -63,5 +233,5 @@ class CSP:
         - Edges: Number of unique edges (constraints).
         """
         num_nodes = len(self.variables)  # Count nodes in the graph.
-        num_edges = sum(len(neighbors) for neighbors in self.constraint_graph.values()) // 2  # Count unique edges.
+        num_edges = sum(len(neighbors) for neighbors in self.constraint_graph) // 2  # Count unique edges.
         print(f"Constraint Graph: {num_nodes} nodes, {num_edges} edges")  # Display graph size.
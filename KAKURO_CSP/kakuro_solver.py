@@ -1,4 +1,5 @@
-from csp import CSP  # Import the CSP class for constraint satisfaction functionality.
+from csp import CSP, DOMAIN_VALUES, KAKURO_COMBOS, KAKURO_FEASIBLE  # Import the CSP class and the bitmask tables.
+from collections import deque  # FIFO queue of arcs for AC-3.
 import time  # Used for performance measurement.
 
 class KakuroSolver:
@@ -9,8 +10,13 @@ class KakuroSolver:
         """
         self.board = board  # Store the puzzle board.
         self.csp = CSP()  # Initialize an instance of CSP to manage variables and constraints.
+        self.initial_domains = ()  # Domains right after parsing, restored before every solve.
         self.assignment_count = 0  # Track the number of assignments during solving.
         self.time_taken = 0  # Track the time taken to solve the puzzle.
+        self.unassigned = set()  # Variable ids not assigned yet in the current search.
+        self.order_stack = []  # Variables assigned by DDB, in assignment order.
+        self.var_pos = {}  # Position of each DDB-assigned variable in order_stack.
+        self.backjump_target = None  # Variable DDB is currently jumping back to, if any.
 
     def parse_board(self):
         """
@@ -44,177 +50,318 @@ class KakuroSolver:
                         v_sum = int(self.board[r][c].split("/")[0])  # Extract the vertical sum.
                         self.add_group_to_csp(v_group, v_sum)  # Add this group to the CSP.
 
+        self.csp.order_constraints_by_tightness()  # Check the most restrictive clues first.
+        self.csp.build_arcs()  # List the arcs of the finished constraint graph.
+        self.initial_domains = tuple(self.csp.domains)  # Snapshot the domains so every solve starts from them.
+
     def add_group_to_csp(self, group, target_sum):
         """
         Adds a group of variables to the CSP with a constraint ensuring their sum matches the target_sum.
         - group: List of variables (cells) in the group.
         - target_sum: The required sum for the group.
         """
-        for var in group:  # Add each variable in the group to the CSP.
-            if var not in self.csp.variables:  # If the variable is not already in the CSP,
-                self.csp.add_variable(var, list(range(1, 10)))  # Add it with a domain of [1-9].
+        union_mask = 0  # Digits appearing in at least one valid combination for this clue.
+        for combo_mask in KAKURO_COMBOS.get((target_sum, len(group)), ()):
+            union_mask |= combo_mask
 
-        def sum_constraint(*values):
-            """
-            Constraint function for the group:
-            - The sum of the values must equal the target sum.
-            - All values must be unique.
-            """
-            return sum(values) == target_sum and len(values) == len(set(values))
+        group_ids = []  # Ids of the group's variables in the CSP.
+        for var in group:  # Add each variable in the group to the CSP.
+            if var not in self.csp.var_index:  # If the variable is not already in the CSP,
+                group_ids.append(self.csp.add_variable(var, union_mask))  # Add it with the digits usable for this clue.
+            else:
+                var_id = self.csp.var_index[var]
+                self.csp.domains[var_id] &= union_mask  # Restrict its domain to the digits usable for this clue.
+                group_ids.append(var_id)
 
-        self.csp.add_constraint(group, sum_constraint)  # Add the sum constraint for the group.
+        self.csp.add_constraint(group_ids, target_sum)  # Add the sum and uniqueness constraint for the group.
 
-    def forward_checking(self, assignment, var, value):
+    def forward_checking(self, assignment, var, value, pruned_domains=None):
         """
         Perform forward checking after assigning a value to a variable.
-        - assignment: Current partial assignment of variables.
-        - var: The variable to which a value is being assigned.
+        Only the constraints shared by var and each neighbor are checked: the neighbor's domain is intersected with the
+        digits that keep the group completable (the group's allowed_mask, taken from KAKURO_FEASIBLE).
+        - assignment: Current partial assignment of variable ids.
+        - var: The variable id to which a value is being assigned.
         - value: The value being assigned.
+        - pruned_domains: Optional list to which the pruned (variable, bitmask) pairs are appended, e.g. the snapshot
+          of the current search depth; a new list is used if omitted.
+        Returns the pruned values as a list of (variable, pruned bitmask) pairs.
         """
-        pruned_domains = {}  # Track pruned domain values.
-        for neighbor in self.csp.get_neighbors(var):  # Check all neighbors of the assigned variable.
+        if pruned_domains is None:
+            pruned_domains = []  # Track pruned domain values.
+        csp = self.csp  # Bind the hot lookups to locals.
+        domains, pair_constraints, allowed_mask = csp.domains, csp.pair_constraints, csp.allowed_mask
+        for neighbor in csp.neighbors_tuple[var]:  # Check all neighbors of the assigned variable.
             if neighbor not in assignment:  # If the neighbor is not yet assigned,
-                pruned_domains[neighbor] = []  # Initialize pruned list for this neighbor.
-                for neighbor_value in self.csp.variables[neighbor]:  # For each value in the neighbor's domain,
-                    temp_assignment = assignment.copy()  # Create a temporary assignment.
-                    temp_assignment[neighbor] = neighbor_value  # Assign the value temporarily.
-                    if not self.csp.is_valid_assignment(temp_assignment):  # If it violates any constraint,
-                        pruned_domains[neighbor].append(neighbor_value)  # Add the value to the pruned list.
-                for pruned_value in pruned_domains[neighbor]:  # Remove all pruned values from the domain.
-                    self.csp.variables[neighbor].remove(pruned_value)
+                domain = domains[neighbor]
+                prune_mask = 0
+                for cid in pair_constraints[(var, neighbor)]:  # Only the shared constraints changed.
+                    prune_mask |= domain & ~allowed_mask[cid]  # Prune the values that cannot complete the group.
+                if prune_mask:  # Remove all pruned values from the domain.
+                    domains[neighbor] = domain & ~prune_mask
+                    pruned_domains.append((neighbor, prune_mask))
         return pruned_domains  # Return the pruned domains.
 
     def restore_domains(self, pruned_domains):
         """
         Restores pruned domains after backtracking.
-        - pruned_domains: A dictionary of pruned values for each variable.
+        - pruned_domains: A list of (variable, pruned bitmask) pairs.
         """
-        for var, values in pruned_domains.items():  # For each variable with pruned values,
-            self.csp.variables[var].extend(values)  # Restore the values to its domain.
+        domains = self.csp.domains
+        for var, prune_mask in pruned_domains:  # For each variable with pruned values,
+            domains[var] |= prune_mask  # Restore the values to its domain.
 
-    def ac3(self):
+    def ac3(self, pruned_domains):
         """
         Applies the AC-3 algorithm to enforce arc-consistency for the CSP.
+        After Xi loses values, an arc (Xk, Xi) is queued again only if Xk still has a value that one of the removed
+        values supported in a constraint shared with Xi; other arcs cannot have lost support.
+        - pruned_domains: List to which the pruned (variable, bitmask) pairs are appended, so they can be restored.
+        Returns False if a domain becomes empty.
         """
-        queue = [(Xi, Xj) for Xi in self.csp.variables for Xj in self.csp.get_neighbors(Xi)]  # Initialize the arc queue.
+        csp = self.csp
+        domains, constraints, supports = csp.domains, csp.constraints, csp.supports
+        queue = deque(csp.arcs)  # Initialize the arc queue with every arc of the graph.
+        in_queue = set(csp.arcs)  # Arcs currently pending, so they are never queued twice.
         while queue:  # Process arcs until the queue is empty.
-            Xi, Xj = queue.pop(0)  # Get an arc from the queue.
-            if self.revise(Xi, Xj):  # Revise the domain of Xi.
-                if not self.csp.variables[Xi]:  # If Xi's domain is empty, return failure.
+            arc = queue.popleft()  # Get an arc from the queue.
+            in_queue.discard(arc)
+            Xi, Xj = arc
+            removed = self.revise(Xi, Xj, pruned_domains)  # Revise the domain of Xi.
+            if removed:
+                if not domains[Xi]:  # If Xi's domain is empty, return failure.
                     return False
-                for Xk in self.csp.get_neighbors(Xi) - {Xj}:  # Add neighbors of Xi back to the queue.
-                    queue.append((Xk, Xi))
+                for cid in csp.var_to_constraints[Xi]:  # Add the affected neighbors of Xi back to the queue.
+                    affected = 0  # Values of the other variables that a removed value supported.
+                    for y in DOMAIN_VALUES[removed]:
+                        affected |= supports[cid][y]
+                    for Xk in constraints[cid]:
+                        if Xk != Xi and Xk != Xj and domains[Xk] & affected and (Xk, Xi) not in in_queue:
+                            queue.append((Xk, Xi))
+                            in_queue.add((Xk, Xi))
         return True  # Arc-consistency enforced.
 
-    def revise(self, Xi, Xj):
+    def revise(self, Xi, Xj, pruned_domains):
         """
         Revise the domain of Xi to ensure arc-consistency with Xj.
         - Xi: Variable whose domain is being revised.
         - Xj: Neighbor variable.
+        - pruned_domains: List to which the pruned (variable, bitmask) pair is appended.
+        Returns the bitmask of the values removed from Xi (0 if the domain was not revised).
         """
-        revised = False
-        for x in self.csp.variables[Xi]:  # For each value in Xi's domain,
-            if not any(self.csp.is_valid_assignment({Xi: x, Xj: y}) for y in self.csp.variables[Xj]):  # If no value in Xj's domain is consistent,
-                self.csp.variables[Xi].remove(x)  # Remove x from Xi's domain.
-                revised = True
-        return revised  # Return whether the domain was revised.
-
-    def select_variable_mrv(self, assignment):
+        domains = self.csp.domains
+        domain_i = domains[Xi]
+        domain_j = domains[Xj]
+        prune_mask = 0
+        for cid in self.csp.pair_constraints[(Xi, Xj)]:
+            supports = self.csp.supports[cid]  # Precomputed supports of each value of Xi in this constraint.
+            for x in DOMAIN_VALUES[domain_i & ~prune_mask]:  # For each value in Xi's domain,
+                if not supports[x] & domain_j:  # If no value in Xj's domain supports it,
+                    prune_mask |= 1 << x  # Remove x from Xi's domain.
+        if prune_mask:
+            domains[Xi] = domain_i & ~prune_mask
+            pruned_domains.append((Xi, prune_mask))
+        return prune_mask  # Return the values removed from Xi.
+
+    def select_variable_mrv(self):
         """
-        Select the variable with the smallest domain (Minimum Remaining Values heuristic).
-        - assignment: Current partial assignment of variables.
+        Select the unassigned variable with the smallest domain (Minimum Remaining Values heuristic).
         """
-        unassigned = [v for v in self.csp.variables if v not in assignment]  # Get all unassigned variables.
-        return min(unassigned, key=lambda var: len(self.csp.variables[var]))  # Return the variable with the smallest domain.
+        domains = self.csp.domains
+        return min(self.unassigned, key=lambda var: domains[var].bit_count())  # Return the variable with the smallest domain.
 
-    def dependency_directed_backtracking(self, assignment={}, conflict_set=None):
+    def order_values_lcv(self, assignment, var, domain):
+        """
+        Orders the values of a variable with the Least Constraining Value heuristic.
+        A value's score is the number of values it leaves in the domains of the unassigned variables of its groups,
+        using the digits KAKURO_FEASIBLE still allows in each group once the value is placed.
+        - assignment: Current partial assignment of variable ids.
+        - var: The variable whose values are ordered.
+        - domain: The bitmask of values to order.
         """
-        Implements Dependency Directed Backtracking (DDB) for the Kakuro solver.
-        - assignment: Current partial assignment of variables.
+        scores = {}
+        for value in DOMAIN_VALUES[domain]:
+            bit = 1 << value
+            score = 0
+            for cid in self.csp.var_to_constraints[var]:
+                remaining = self.csp.size[cid] - self.csp.assigned_count[cid] - 1  # Cells left once var is assigned.
+                allowed = KAKURO_FEASIBLE.get((self.csp.target[cid], remaining, self.csp.used_mask[cid] | bit), 0)
+                for neighbor in self.csp.constraints[cid]:
+                    if neighbor != var and neighbor not in assignment:
+                        score += (self.csp.domains[neighbor] & allowed).bit_count()  # Values the neighbor keeps.
+            scores[value] = score
+        return sorted(DOMAIN_VALUES[domain], key=scores.__getitem__, reverse=True)  # Least constraining first.
+
+    def start_search(self, assignment):
+        """
+        Prepares the CSP for a new search from a partial assignment: the state left by a previous search is cleared,
+        then each pre-assigned variable is recorded in its constraints and its domain reduced to its value.
+        Returns False if the partial assignment violates a domain or a constraint.
+        - assignment: Initial partial assignment of variable ids.
+        """
+        self.csp.reset_assignment()  # Clear the constraint state left by a previous search.
+        self.csp.domains[:] = self.initial_domains  # Undo the domain pruning left by a previous search.
+        self.unassigned = set(range(len(self.csp.variables))) - assignment.keys()
+        for var, value in assignment.items():
+            if not self.csp.domains[var] >> value & 1 or not self.csp.is_consistent(var, value):
+                return False  # The pre-assigned value cannot be part of a solution.
+            self.csp.assign(var, value)
+            self.csp.domains[var] = 1 << value
+        return True
+
+    def dependency_directed_backtracking(self, assignment, methods=None, conflict_set=None):
+        """
+        Implements Dependency Directed Backtracking (DDB) for the Kakuro solver, as conflict-directed backjumping:
+        when a variable runs out of values, the search jumps back to the most recently assigned variable of its
+        conflict set, skipping the variables in between, and passes the rest of the conflict set on to it.
+        - assignment: Current partial assignment of variable ids.
+        - methods: Dictionary of methods; FFP selects variables with MRV.
         - conflict_set: Tracks conflicts for backjumping.
         """
         if conflict_set is None:  # Initialize the conflict set if not provided.
-            conflict_set = {var: set() for var in self.csp.variables}
-
-        if len(assignment) == len(self.csp.variables):  # If all variables are assigned,
+            conflict_set = [set() for _ in self.csp.variables]
+            if not self.start_search(assignment):  # The initial assignment is already inconsistent.
+                return None
+            self.order_stack = []
+            self.var_pos = {}
+            self.backjump_target = None
+
+        if not self.unassigned:  # If all variables are assigned,
             return assignment  # Return the complete assignment.
 
-        var = next(v for v in self.csp.variables if v not in assignment)  # Select the first unassigned variable.
+        if methods and "FFP" in methods:  # Use Minimum Remaining Values (MRV) if FFP is specified.
+            var = self.select_variable_mrv()
+        else:  # Otherwise, select the first unassigned variable.
+            var = next(iter(self.unassigned))
+        conflict_set[var] = set()  # Conflicts from a previous visit of var no longer apply.
 
-        for value in self.csp.variables[var]:  # Iterate over the variable's domain.
-            assignment[var] = value  # Assign the value.
+        for value in DOMAIN_VALUES[self.csp.domains[var]]:  # Iterate over the variable's domain.
             self.assignment_count += 1  # Increment the assignment count.
 
-            if self.csp.is_valid_assignment(assignment):  # Check if the assignment is valid.
-                result = self.dependency_directed_backtracking(assignment,
+            if self.csp.is_consistent(var, value):  # Check if the assignment is valid.
+                assignment[var] = value  # Assign the value.
+                self.csp.assign(var, value)
+                self.unassigned.discard(var)
+                self.var_pos[var] = len(self.order_stack)
+                self.order_stack.append(var)
+                result = self.dependency_directed_backtracking(assignment, methods,
                                                                conflict_set)  # Recurse with updated assignment.
                 if result:  # If a solution is found,
                     return result  # Return it.
 
-            del assignment[var]  # Backtrack by removing the assignment.
+                del assignment[var]  # Backtrack by removing the assignment.
+                self.csp.unassign(var, value)
+                self.unassigned.add(var)
+                self.order_stack.pop()
+                del self.var_pos[var]
+                if self.backjump_target != var:  # The failure does not depend on var: keep jumping back.
+                    return None
+                self.backjump_target = None  # The jump lands here: try the next value of var.
 
-        # If no value works, update the conflict set for backjumping.
+        # If no value works, the assigned neighbors that constrain var join its conflict set.
         for neighbor in self.csp.get_neighbors(var):  # Check all neighbors.
             if neighbor in assignment:  # If the neighbor is already assigned,
-                conflict_set[neighbor].add(var)  # Add the current variable to its conflict set.
+                conflict_set[var].add(neighbor)
 
         # Backjump to the most recent variable in the conflict set.
-        valid_conflicts = [v for v in conflict_set[var] if v in assignment]  # Only consider valid conflicts.
+        valid_conflicts = [v for v in conflict_set[var] if v in self.var_pos]  # Only consider valid conflicts.
         if valid_conflicts:  # If there are valid conflicts,
-            backjump_target = max(valid_conflicts, key=lambda v: list(assignment).index(v))  # Get the most recent one.
-            del assignment[backjump_target]  # Remove it from the assignment.
+            backjump_target = max(valid_conflicts, key=self.var_pos.__getitem__)  # Get the most recent one.
+            conflict_set[backjump_target].update(v for v in valid_conflicts if v != backjump_target)
+            self.backjump_target = backjump_target
         else:
-            return None  # No valid backjump target; terminate.
+            self.backjump_target = -1  # No assignment caused the failure: terminate the whole search.
 
         return None  # Return None if no solution is found.
 
-    def backtracking_with_methods(self, assignment={}, methods=None):
+    def backtracking_with_methods(self, assignment=None, methods=None):
         """
         General backtracking algorithm with optional methods, including DDB.
-        - methods: Dictionary specifying which methods to use (e.g., forward checking, AC-3, DDB, FFP).
+        The search is iterative: each stack frame holds a node's variable, its remaining values and the values
+        pruned by AC-3 at that node, and the single shared assignment is undone when a frame is revisited.
+        - assignment: Initial partial assignment of variable ids (empty by default).
+        - methods: Dictionary specifying which methods to use (e.g., forward checking, AC-3, DDB, FFP, LCV).
         """
-        if len(assignment) == len(self.csp.variables):  # If all variables are assigned,
-            return assignment  # Return the complete assignment.
+        if assignment is None:
+            assignment = {}
 
         if methods and "DDB" in methods:  # Use Dependency Directed Backtracking if specified.
-            return self.dependency_directed_backtracking(assignment)
-
-        if methods and "AC-3" in methods:  # Apply AC-3 if specified.
-            self.ac3()
-
-        if methods and "FFP" in methods:  # Use Minimum Remaining Values (MRV) if FFP is specified.
-            var = self.select_variable_mrv(assignment)
-        else:  # Otherwise, select the first unassigned variable.
-            var = next(v for v in self.csp.variables if v not in assignment)
-
-        for value in self.csp.variables[var]:  # Iterate over the values in the variable's domain.
-            assignment[var] = value  # Assign the value.
-            self.assignment_count += 1  # Increment the assignment count.
-
-            pruned_domains = {}
-            if methods and "Forward Checking" in methods:  # Perform forward checking if specified.
-                pruned_domains = self.forward_checking(assignment, var, value)
-
-            if self.csp.is_valid_assignment(assignment):  # Check if the assignment is valid.
-                result = self.backtracking_with_methods(assignment, methods)  # Recurse with the updated assignment.
-                if result:  # If a solution is found,
-                    return result
-
-            del assignment[var]  # Backtrack by removing the variable's assignment.
-            if methods and "Forward Checking" in methods:  # Restore domains if forward checking was used.
-                self.restore_domains(pruned_domains)
-
-        return None  # Return None if no solution is found.
+            return self.dependency_directed_backtracking(assignment, methods)
+
+        if not self.start_search(assignment):  # The initial assignment is already inconsistent.
+            return None
+
+        use_ac3 = bool(methods and "AC-3" in methods)
+        use_ffp = bool(methods and "FFP" in methods)
+        use_fc = bool(methods and "Forward Checking" in methods)
+        use_lcv = bool(methods and "LCV" in methods)
+
+        stack = []  # Search frames: (variable, original domain, iterator over its values, values pruned by AC-3).
+        value_pruned = []  # Values pruned by the assignment made at each depth, restored when it is undone.
+        descend = True  # Whether a new node has been reached and must be expanded.
+        while True:
+            if descend:
+                if not self.unassigned:  # If all variables are assigned,
+                    return assignment  # Return the complete assignment.
+
+                arc_pruned = []  # Values pruned by AC-3 at this node, restored when the node is left.
+                if use_ac3 and not self.ac3(arc_pruned):  # A domain was wiped out, so this node is a dead end.
+                    self.restore_domains(arc_pruned)
+                else:
+                    if use_ffp:  # Use Minimum Remaining Values (MRV) if FFP is specified.
+                        var = self.select_variable_mrv()
+                    else:  # Otherwise, select the first unassigned variable.
+                        var = next(iter(self.unassigned))
+                    domain = self.csp.domains[var]
+                    if use_lcv:  # Try the least constraining values first if LCV is specified.
+                        values = self.order_values_lcv(assignment, var, domain)
+                    else:  # Otherwise, try the values in increasing order.
+                        values = DOMAIN_VALUES[domain]
+                    stack.append((var, domain, iter(values), arc_pruned))
+
+            if not stack:  # Every value of the root variable failed.
+                return None  # Return None if no solution is found.
+
+            var, domain, values, arc_pruned = stack[-1]
+            if var in assignment:  # Undo the value previously tried at this node.
+                self.csp.unassign(var, assignment.pop(var))
+                self.unassigned.add(var)
+                self.restore_domains(value_pruned.pop())
+
+            descend = False
+            for value in values:  # Try the next values in the variable's domain.
+                self.assignment_count += 1  # Increment the assignment count.
+                if not self.csp.is_consistent(var, value):  # Skip values that violate a constraint of var.
+                    continue
+
+                assignment[var] = value  # Assign the value.
+                self.csp.assign(var, value)
+                self.unassigned.discard(var)
+
+                pruned_domains = [(var, domain & ~(1 << value))]  # Reduce var's domain to the assigned value.
+                self.csp.domains[var] = 1 << value
+                if use_fc:  # Perform forward checking if specified.
+                    self.forward_checking(assignment, var, value, pruned_domains)  # Record into this depth's snapshot.
+                value_pruned.append(pruned_domains)
+                descend = True
+                break
+
+            if not descend:  # No value left: backtrack to the previous node.
+                stack.pop()
+                self.restore_domains(arc_pruned)
 
     def solve_with_methods(self, methods=None):
         """
         Solve the Kakuro puzzle using backtracking with specified methods.
+        Returns the solution as a dictionary mapping each cell to its value, or None.
         """
         self.assignment_count = 0  # Reset the assignment count.
         start_time = time.time()  # Start timing.
         solution = self.backtracking_with_methods({}, methods)  # Solve using the specified methods.
         self.time_taken = time.time() - start_time  # Record the time taken to solve.
-        return solution  # Return the solution.
+        if solution is None:
+            return None
+        return {self.csp.variables[var]: value for var, value in solution.items()}  # Map variable ids back to cells.
 
     def display_metrics(self):
         """
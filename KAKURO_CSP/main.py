@@ -1,6 +1,19 @@
+from concurrent.futures import ProcessPoolExecutor  # Runs the method combinations in parallel processes.
+from itertools import repeat
 from kakuro_solver import KakuroSolver
 
 
+def solve_one(board, methods):
+    """
+    Solves a board with one combination of methods, using a fresh solver.
+    Returns the solver (which holds the metrics of the run) and the solution.
+    """
+    solver = KakuroSolver(board)  # Create a solver instance.
+    solver.parse_board()  # Parse the board into CSP variables and constraints.
+    solution = solver.solve_with_methods(methods)  # Solve using the specified methods.
+    return solver, solution
+
+
 def main():
     # Define the Kakuro puzzle board as a 2D list.
     #6X6 (18 nec) -> SOLUTION
@@ -71,10 +84,6 @@ def main():
     ]
 
 
-
-    solver = KakuroSolver(board2)  # Create a solver instance.
-    solver.parse_board()  # Parse the board into CSP variables and constraints.
-
     # Define combinations of methods to test.
     methods_combinations = {
         "Baseline Backtracking": {},
@@ -86,11 +95,14 @@ def main():
         "Backtracking + Forward Checking + DDB": {"Forward Checking": True, "DDB": True},
         "Backtracking + Forward Checking + AC-3 + FFP": {"Forward Checking": True, "AC-3": True, "FFP": True},
         "Backtracking + Forward Checking + AC-3 + DDB": {"Forward Checking": True, "AC-3": True, "DDB": True},
+        "Backtracking + Forward Checking + FFP + LCV": {"Forward Checking": True, "FFP": True, "LCV": True},
     }
 
-    for name, methods in methods_combinations.items():  # Test each method combination.
+    with ProcessPoolExecutor() as executor:  # Test each method combination in its own process.
+        results = list(executor.map(solve_one, repeat(board2), methods_combinations.values()))
+
+    for name, (solver, solution) in zip(methods_combinations, results):  # Report the results in order.
         print(f"\nMethod: {name}")
-        solution = solver.solve_with_methods(methods)  # Solve using the specified methods.
         solver.display_metrics()  # Display metrics.
         if solution:  # If a solution is found,
             print("Solution Found:")